@@ -0,0 +1,57 @@
+"""
+Shared fissix tree helpers for the fixer scripts.
+"""
+
+from __future__ import annotations
+
+from typing import List, Optional
+
+from bowler.types import LN
+from fissix.pytree import Node
+
+
+def get_children(
+    node: Node,
+    childtype: int,
+    *,
+    recursive: bool = False,
+    recurse_if_found: bool = False,
+    recurse_depth: Optional[int] = None,
+) -> List[LN]:
+    """Extract all children from a node that match a type.
+    Arguments:
+        node: The node to search the children of. Won't be matched.
+        childtype: The symbol/token code to search for
+        recursive:
+            If False, only the immediate children of the node will be searched
+        recurse_if_found:
+            If False, will stop recursing once a node has been found. If True,
+            it is possible to have node types that are children of other nodes
+            that were found earlier in the search.
+        recurse_depth:
+            How deep to go. None for any depth.
+    Returns:
+        A list of nodes matching the search type.
+    """
+    children = node.children
+    if not recursive or (recurse_depth is not None and recurse_depth <= 0):
+        return [x for x in children if x.type == childtype]
+    if recurse_depth is not None:
+        recurse_depth -= 1
+    matches = []
+    for child in children:
+        if child.type == childtype:
+            matches.append(child)
+            # If we want to stop recursing into found nodes
+            if recurse_if_found:
+                continue
+        matches.extend(
+            get_children(
+                child,
+                childtype,
+                recursive=True,
+                recurse_if_found=recurse_if_found,
+                recurse_depth=recurse_depth,
+            )
+        )
+    return matches
@@ -18,15 +18,15 @@ import argparse
 import sys
 from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional
+from typing import Optional
 
 import fissix.pgen2
 import fissix.pygram
 import fissix.pytree
 import pytest
+from _treeutil import get_children
 from bowler import Query
 from bowler.types import LN, Capture, Filename
-from fissix.fixer_util import Comma
 from fissix.pgen2 import token
 from fissix.pygram import python_symbols
 from fissix.pytree import Leaf, Node, type_repr
@@ -41,6 +41,22 @@ PATTERN = """import_name | import_from"""
 IGNORE_IF = False
 ONLY_FLOAT = set()
 
+# Imports that are always safe to float, regardless of surroundings
+IMPORT_WHITELIST = frozenset(
+    {
+        "importlib",
+        "math",
+        "optparse",
+        "os",
+        "os.path",
+        "six.moves.cPickle as pickle",
+        "six.moves",
+        "sys",
+        "urllib2",
+        "uuid",
+    }
+)
+
 # Build a driver to help generate nodes from known code
 # Used in testing
 driver = fissix.pgen2.driver.Driver(
@@ -103,56 +119,6 @@ def get_child(node: Node, childtype: int) -> Optional[LN]:
     return filt[0] if filt else None
 
 
-def get_children(
-    node: Node,
-    childtype: int,
-    *,
-    recursive: bool = False,
-    recurse_if_found=False,
-    recurse_depth=None,
-) -> List[LN]:
-    """Extract all children from a node that match a type.
-    Arguments:
-        node: The node to search the children of. Won't be matched.
-        childtype: The symbol/token code to search for
-        recursive:
-            If False, only the immediate children of the node will be searched
-        recurse_if_found:
-            If False, will stop recursing once a node has been found. If True,
-            it is possible to have node types that are children of other nodes
-            that were found earlier in the search.
-        recurse_depth:
-            How deep to go. None for any depth.
-    Returns:
-        A list of nodes matching the search type.
-    """
-    if not recursive or (recurse_depth is not None and recurse_depth <= 0):
-        return [x for x in node.children if x.type == childtype]
-    if recurse_depth is not None:
-        recurse_depth -= 1
-    matches = []
-    for child in node.children:
-        if child.type == childtype:
-            matches.append(child)
-            # If we want to stop recursing into found nodes
-            if recurse_if_found:
-                continue
-        matches.extend(
-            get_children(child, childtype, recursive=True, recurse_depth=recurse_depth)
-        )
-    return matches
-
-
-def join_comma(entries):
-    """Return a copy of a list with comma tokens between items"""
-    out = [entries[0]]
-    if len(entries) > 1:
-        for entry in entries[1:]:
-            out.append(Comma())
-            out.append(entry)
-    return out
-
-
 # Accessing grammar types:  python_symbols.import_from
 #           parting tokens: token.COMMA
 
@@ -237,18 +203,6 @@ def process_import(node: LN, capture: Capture, filename: Filename) -> Optional[L
     if node.parent.parent.type == python_symbols.file_input:
         return
 
-    IMPORT_WHITELIST = {
-        "importlib",
-        "math",
-        "optparse",
-        "os",
-        "os.path",
-        "six.moves.cPickle as pickle",
-        "six.moves",
-        "sys",
-        "urllib2",
-        "uuid",
-    }
     module_name = str(node.children[1]).strip()
 
     always_float = module_name in IMPORT_WHITELIST
@@ -277,7 +231,9 @@ def process_import(node: LN, capture: Capture, filename: Filename) -> Optional[L
         )
         return
 
-    if "matplotlib" in str(node):
+    if any(
+        leaf.type == token.NAME and leaf.value == "matplotlib" for leaf in node.leaves()
+    ):
         print(f"Not floating {filename}:{node.get_lineno()} as matplotlib")
         return
 
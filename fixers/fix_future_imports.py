@@ -24,12 +24,13 @@ declarations.
 from __future__ import annotations
 
 import argparse
-from typing import List, Optional
+import os
+from typing import Optional
 
 import fissix.pgen2
+from _treeutil import get_children
 from bowler import Query
 from bowler.types import LN, Capture, Filename
-from fissix.fixer_util import Comma, Name
 from fissix.pgen2 import token
 from fissix.pygram import python_symbols
 from fissix.pytree import Node
@@ -38,57 +39,12 @@ driver = fissix.pgen2.driver.Driver(
     fissix.pygram.python_grammar, convert=fissix.pytree.convert
 )
 
-FLOAT_MODE = False
-
-
-def get_children(
-    node: Node,
-    childtype: int,
-    *,
-    recursive: bool = False,
-    recurse_if_found=False,
-    recurse_depth=None,
-) -> List[LN]:
-    """Extract all children from a node that match a type.
-    Arguments:
-        node: The node to search the children of. Won't be matched.
-        childtype: The symbol/token code to search for
-        recursive:
-            If False, only the immediate children of the node will be searched
-        recurse_if_found:
-            If False, will stop recursing once a node has been found. If True,
-            it is possible to have node types that are children of other nodes
-            that were found earlier in the search.
-        recurse_depth:
-            How deep to go. None for any depth.
-    Returns:
-        A list of nodes matching the search type.
-    """
-    if not recursive or (recurse_depth is not None and recurse_depth <= 0):
-        return [x for x in node.children if x.type == childtype]
-    if recurse_depth is not None:
-        recurse_depth -= 1
-    matches = []
-    for child in node.children:
-        if child.type == childtype:
-            matches.append(child)
-            # If we want to stop recursing into found nodes
-            if recurse_if_found:
-                continue
-        matches.extend(
-            get_children(child, childtype, recursive=True, recurse_depth=recurse_depth)
-        )
-    return matches
-
+# Parsed once through the shared driver; cloned for every file that needs it
+STANDARD_FUTURE_IMPORT = driver.parse_string(
+    "from __future__ import absolute_import, division, print_function\n"
+)
 
-def join_comma(entries: List[LN]) -> List[LN]:
-    """Join a list with a comma token"""
-    out = [entries[0]]
-    if len(entries) > 1:
-        for entry in entries[1:]:
-            out.append(Comma())
-            out.append(entry)
-    return out
+FLOAT_MODE = False
 
 
 def find_future_import_insert_point(node: Node):
@@ -137,38 +93,47 @@ def process_root(node: LN, capture: Capture, filename: Filename) -> Optional[LN]
     elif len(imports) == 0:
         # We're in update mode - add missing __future__ imports
         import_insert_point = find_future_import_insert_point(node)
-        insert = driver.parse_string(
-            "from __future__ import absolute_import, division, print_function\n"
-        )
+        insert = STANDARD_FUTURE_IMPORT.clone()
         node.children.insert(import_insert_point, insert)
         return
 
     # Extract the list of __future__ imports from all of the import statements
-    future_names = set()
+    # Use a dict as an ordered set, so that the names are only deduplicated once
+    future_names = {}
     for imp in imports:
-        if imp.children[3].type == token.NAME:
-            future_names.add(imp.children[3].value)
-        elif imp.children[3].type == python_symbols.import_as_names:
+        names = imp.children[3]
+        if names.type == token.LPAR:
+            names = imp.children[4]
+        if names.type == token.NAME:
+            future_names[names.value] = None
+        elif names.type == python_symbols.import_as_names:
             future_names.update(
-                {x.value for x in get_children(imp.children[3], token.NAME)}
+                dict.fromkeys(x.value for x in get_children(names, token.NAME))
             )
     # If we're not purely floating, update the list of names
     if not FLOAT_MODE:
         # If present, make all the basics present
         if future_names:
-            future_names |= {"absolute_import", "division", "print_function"}
+            future_names.update(
+                dict.fromkeys(("absolute_import", "division", "print_function"))
+            )
 
         # Remove anything already mandatory
-        future_names -= {"generators", "nested_scopes", "with_statement"}
-
-    # Update the first import instance with all the names
-    if len(future_names) == 1:
-        imports[0].children[3] = Name(list(future_names)[0])
-    else:
-        # Make the first one a multi-import
-        commad = join_comma([Name(x, prefix=" ") for x in sorted(future_names)])
-        names = Node(python_symbols.import_as_names, commad)
-        imports[0].children[3] = names
+        for name in ("generators", "nested_scopes", "with_statement"):
+            future_names.pop(name, None)
+
+    # Replace the first import instance with one importing all the names. This
+    # is parsed from source rather than assembled leaf-by-leaf.
+    new_import = (
+        driver.parse_string(
+            "from __future__ import " + ", ".join(sorted(future_names)) + "\n"
+        )
+        .children[0]
+        .children[0]
+    )
+    new_import.remove()
+    new_import.prefix = imports[0].prefix
+    imports[0].replace(new_import)
 
     # Remove the other imports
     for imp in imports[1:]:
@@ -176,6 +141,17 @@ def process_root(node: LN, capture: Capture, filename: Filename) -> Optional[LN]
         imp.parent.parent.children.remove(imp.parent)
 
 
+def mentions_future(filename: Filename) -> bool:
+    """Cheap pre-parse check for whether a file could have __future__ imports"""
+    with open(filename, "rb") as f:
+        return b"__future__" in f.read()
+
+
+def is_floatable_file(filename: Filename) -> bool:
+    """Filename matcher for float mode: python files that mention __future__"""
+    return filename.endswith(".py") and mentions_future(filename)
+
+
 def main():
     """Runs the query. Called by bowler if run as a script"""
     parser = argparse.ArgumentParser(description=__doc__)
@@ -195,8 +171,18 @@ def main():
     global FLOAT_MODE
     FLOAT_MODE = args.onlyfloat
 
+    paths = args.filenames
+    filename_matcher = None
+    if FLOAT_MODE:
+        # Floating only touches files that already have __future__ imports, so
+        # don't hand anything else over to be parsed
+        paths = [x for x in paths if os.path.isdir(x) or mentions_future(x)]
+        if args.filenames and not paths:
+            return
+        filename_matcher = is_floatable_file
+
     (
-        Query(args.filenames)
+        Query(paths, filename_matcher=filename_matcher)
         .select_root()
         .modify(process_root)
         .execute(interactive=False, write=args.do, silent=args.silent)
@@ -6,13 +6,13 @@ Find all extension imports and (eventually) rewrite them
 from __future__ import annotations
 
 import argparse
+import os
 import pprint
-from pathlib import Path
-from typing import List, Optional
+import sys
+from typing import Iterator, Optional
 
 from bowler import Query
 from bowler.types import LN, Capture, Filename
-from fissix.fixer_util import Comma
 from fissix.pgen2 import token
 from fissix.pygram import python_symbols
 from fissix.pytree import Leaf, Node, type_repr
@@ -68,7 +68,7 @@ def print_node(node: LN, max_depth: int = 1000, indent: str = "", last: bool = T
     if max_depth == 0 and children:
         print(indent + f"└─...{len(children)} children")
     else:
-        for i, child in enumerate(node.children):
+        for i, child in enumerate(children):
             print_node(
                 child,
                 indent=indent,
@@ -84,56 +84,6 @@ def get_child(node: Node, childtype: int) -> Optional[LN]:
     return filt[0] if filt else None
 
 
-def get_children(
-    node: Node,
-    childtype: int,
-    *,
-    recursive: bool = False,
-    recurse_if_found=False,
-    recurse_depth=None,
-) -> List[LN]:
-    """Extract all children from a node that match a type.
-    Arguments:
-        node: The node to search the children of. Won't be matched.
-        childtype: The symbol/token code to search for
-        recursive:
-            If False, only the immediate children of the node will be searched
-        recurse_if_found:
-            If False, will stop recursing once a node has been found. If True,
-            it is possible to have node types that are children of other nodes
-            that were found earlier in the search.
-        recurse_depth:
-            How deep to go. None for any depth.
-    Returns:
-        A list of nodes matching the search type.
-    """
-    if not recursive or (recurse_depth is not None and recurse_depth <= 0):
-        return [x for x in node.children if x.type == childtype]
-    if recurse_depth is not None:
-        recurse_depth -= 1
-    matches = []
-    for child in node.children:
-        if child.type == childtype:
-            matches.append(child)
-            # If we want to stop recursing into found nodes
-            if recurse_if_found:
-                continue
-        matches.extend(
-            get_children(child, childtype, recursive=True, recurse_depth=recurse_depth)
-        )
-    return matches
-
-
-def join_comma(entries):
-    """Return a copy of a list with comma tokens between items"""
-    out = [entries[0]]
-    if len(entries) > 1:
-        for entry in entries[1:]:
-            out.append(Comma())
-            out.append(entry)
-    return out
-
-
 # Accessing grammar types:  python_symbols.import_from
 #           parting tokens: token.COMMA
 
@@ -184,8 +134,10 @@ def find_prev_leaf(node: LN) -> LN:
             node = node.parent
     node = node.prev_sibling
     # Now navigate down the tree to the last leaf
-    while node.children:
-        node = node.children[-1]
+    children = node.children
+    while children:
+        node = children[-1]
+        children = node.children
     return node
 
 
@@ -345,6 +297,15 @@ def process_import(node: LN, capture: Capture, filename: Filename) -> Optional[L
 # node.prefix = ""
 
 
+def iter_libs(path: str) -> Iterator[str]:
+    """Yield the names of all built extension libraries in a directory."""
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.endswith(".so"):
+                # Interned, as these are compared against every import name
+                yield sys.intern(entry.name[:-3])
+
+
 def main():
     """Runs the query. Called by bowler if run as a script"""
     global LIBS
@@ -366,7 +327,7 @@ def main():
     )
     args = parser.parse_args()
 
-    LIBS = [x.stem for x in Path(args.library_path).glob("*.so")]
+    LIBS = frozenset(iter_libs(args.library_path))
     print(f"Looking for {len(LIBS)} library imports")
     # print(", ".join(LIBS))
     # global IGNORE_IF
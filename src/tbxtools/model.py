@@ -7,11 +7,43 @@ Contains the model objects for a tbx-like distribution
 from __future__ import annotations
 
 import ast
+import functools
+import json
 import logging
 import os
+import re
+import stat
 
 logger = logging.getLogger(__name__)
 
+# Matches a trailing comma before a closing bracket. Strings are matched
+# first, so that commas inside them are left alone.
+_TRAILING_COMMA = re.compile(r'("(?:[^"\\]|\\.)*")|,(\s*[}\]])')
+
+
+def _parse_libtbx_config(text):
+    """Parse the contents of a libtbx_config file.
+
+    Almost all of these are json apart from trailing commas, which is much
+    faster to parse. Anything else falls back to a full python literal parse.
+    """
+    try:
+        return json.loads(_TRAILING_COMMA.sub(lambda m: m.group(1) or m.group(2), text))
+    except ValueError:
+        return ast.literal_eval(text)
+
+
+@functools.lru_cache(maxsize=4096)
+def _load_libtbx_config(path, mtime, size):
+    """Parse a libtbx_config file. Keyed on mtime/size so edits are picked up.
+
+    The result is shared between callers, so must not be modified.
+    """
+    with open(path) as f:
+        # Unfortunately, these files aren't json but some custom-written
+        # python dictionary syntax (e.g. json + trailing commas)
+        return _parse_libtbx_config(f.read())
+
 
 class DependencyError(RuntimeError):
     "Represents an error resolving module dependencies"
@@ -52,21 +84,26 @@ class Module(object):
 
         # Load information about this module from the libtbx_config... if there is one
         config_filename = os.path.join(dist.path, self.path, "libtbx_config")
-        if os.path.isfile(config_filename):
-            with open(config_filename) as f:
-                # Unfortunately, these files aren't json but some custom-written
-                # python dictionary syntax (e.g. json + trailing commas)
-                for key, value in ast.literal_eval(f.read()).items():
-                    if key not in self.config:
-                        logger.warning(
-                            "Unknown libtbx_config key {} in module {}".format(
-                                key, self.name
-                            )
+        try:
+            config_stat = os.stat(config_filename)
+        except OSError:
+            config_stat = None
+        if config_stat and stat.S_ISREG(config_stat.st_mode):
+            config = _load_libtbx_config(
+                config_filename, config_stat.st_mtime_ns, config_stat.st_size
+            )
+            for key, value in config.items():
+                if key not in self.config:
+                    logger.warning(
+                        "Unknown libtbx_config key {} in module {}".format(
+                            key, self.name
                         )
-                    # Convert lists to sets
-                    if isinstance(value, list):
-                        value = set(value)
-                    self.config[key] = value
+                    )
+                # Convert lists to sets. Sets are copied too, as the parsed
+                # config is cached and shared between modules.
+                if isinstance(value, (list, set)):
+                    value = set(value)
+                self.config[key] = value
 
     def __repr__(self):
         return "<Module {}>".format(self.name)
@@ -100,6 +137,8 @@ class Distribution(object):
         self._modules = {}
         self._requested_modules = set()
         self._ignore_missing = set(ignore_missing) if ignore_missing else set()
+        # Map of directory name to module path, built on first lookup
+        self._repo_index = None
 
         # Without libtbx it's probably not a tbx-distribution?
         if not self.load_module("libtbx"):
@@ -110,9 +149,20 @@ class Distribution(object):
 
     def _find_module_dir(self, name):
         "Search the distribution for a path matching a module name"
-        for repo in self.repositories:
-            if os.path.isdir(os.path.join(self.path, repo, name)):
-                return os.path.normpath(os.path.join(repo, name))
+        if self._repo_index is None:
+            # List each repository once, instead of checking every lookup
+            self._repo_index = {}
+            for repo in self.repositories:
+                try:
+                    entries = list(os.scandir(os.path.join(self.path, repo)))
+                except OSError:
+                    continue
+                for entry in entries:
+                    if entry.is_dir():
+                        self._repo_index.setdefault(
+                            entry.name, os.path.normpath(os.path.join(repo, entry.name))
+                        )
+        return self._repo_index.get(name)
 
     def _load_dependencies_for(self, module):
         "Ensure the dependencies for a given module are loaded"
@@ -3,9 +3,11 @@
 from __future__ import annotations
 
 import enum
+import operator
+import os
 import re
-from io import StringIO
-from math import floor, log10
+import weakref
+from functools import lru_cache, reduce
 
 from libtbx import phil
 
@@ -38,7 +40,29 @@ class Flags(enum.IntEnum):
 
     @classmethod
     def resolve(cls, value):
-        return FlagViewer({ev for ev in cls if value & ev.value})
+        return FlagViewer(_resolve_flags(value))
+
+
+# Flags covering exactly one bit, by value, and those spanning several bits
+_SINGLE_BIT_FLAGS = {ev.value: ev for ev in Flags if not ev.value & (ev.value - 1)}
+_COMPOUND_FLAGS = tuple((ev.value, ev) for ev in Flags if ev.value & (ev.value - 1))
+_ALL_FLAG_BITS = reduce(operator.or_, (ev.value for ev in Flags))
+
+
+@lru_cache(maxsize=4096)
+def _resolve_flags(value):
+    """Cached lookup of the set flags; the same few values get resolved a lot"""
+    found = set()
+    # Walk only the set bits, lowest first
+    remaining = value & _ALL_FLAG_BITS
+    while remaining:
+        lowest = remaining & -remaining
+        remaining ^= lowest
+        if lowest in _SINGLE_BIT_FLAGS:
+            found.add(_SINGLE_BIT_FLAGS[lowest])
+    # Compound flags count as set if any of their bits are
+    found.update(ev for bits, ev in _COMPOUND_FLAGS if value & bits)
+    return frozenset(found)
 
 
 class FlagViewer(set):
@@ -53,47 +77,77 @@ class FlagViewer(set):
 # Remove dtype= section from numpy output
 re_remove_dtype = re.compile(r"(?:,|\()\s*dtype=\w+(?=,|\))")
 # Regular expression to help make repr's oneline
-reReprToOneLine = re.compile("\n\\s+")
+reReprToOneLine = re.compile("\\s*\n\\s*")
+
+# Renames the leading array( and removes dtype= from numpy output in one pass
+reFlexRepr = re.compile(r"^array\(|" + re_remove_dtype.pattern)
+
+# Bound once, as these are used for every repr
+_FLEX_REPR_SUB = reFlexRepr.sub
+_ONE_LINE_SUB = reReprToOneLine.sub
 
 _summaryEdgeItems = 3  # repr N leading and trailing items of each dimension
 _summaryThreshold = 1000  # total items > triggers array summarization
 
 
+# Sorted attribute names and value width for larger scopes, checked against
+# the scope's current attribute names before reuse
+_phil_names_cache = weakref.WeakKeyDictionary()
+
+
+def _phil_names(self):
+    """Get the sorted public names in a scope, and the widest non-scope name"""
+    keys = self.__dict__.keys()
+    cached = _phil_names_cache.get(self)
+    if cached is not None and cached[0] == keys:
+        return cached[1], cached[2]
+    # Step over every named element in this, tracking the maximum length
+    # of an attribute (non sub-scope) value as we go
+    phil_names = []
+    max_len = 0
+    for name, value in self.__dict__.items():
+        if name.startswith("_"):
+            continue
+        phil_names.append(name)
+        if len(name) > max_len and not isinstance(value, phil.scope_extract):
+            max_len = len(name)
+    phil_names.sort()
+    if len(keys) > 8:
+        _phil_names_cache[self] = (frozenset(keys), phil_names, max_len)
+    return phil_names, max_len
+
+
 def _phil_repr(self, in_scope=False):
     """Hack in a phil.scope_extract repr function"""
-    s = StringIO()
+    parts = []
     if not in_scope:
-        s.write('<phil.scope_extract """')
-    s.write("{\n")
-    # Step over every named element in this
-    phil_names = sorted([x for x in self.__dict__ if not x.startswith("_")])
-    # Get the maximum length of an attribute (non sub-scope) value
-    max_len = max(
-        len(x)
-        for x in phil_names
-        if not isinstance(getattr(self, x), phil.scope_extract)
-    )
+        parts.append('<phil.scope_extract """')
+    parts.append("{\n")
+    phil_names, max_len = _phil_names(self)
+    attrs = self.__dict__
     for name in phil_names:
-        s.write("  " + name.ljust(max_len) + " ")
-        value = getattr(self, name)
+        parts.append("  " + name.ljust(max_len) + " ")
+        value = attrs[name]
 
         if isinstance(value, phil.scope_extract):
             # Get the representation, then add an indentation to every line
             subscope = value.__repr__(in_scope=True)
-            subscope = "\n".join("  " + x for x in subscope.splitlines()).strip()
-            s.write(subscope)
+            parts.append(subscope.replace("\n", "\n  ").strip())
         else:
             # Just output the value
-            s.write("= " + repr(value))
-        s.write("\n")
-    s.write("}")
+            parts.append("= " + repr(value))
+        parts.append("\n")
+    parts.append("}")
     if not in_scope:
-        s.write('""">')
-    return s.getvalue()
+        parts.append('""">')
+    return "".join(parts)
 
 
 def _miller_repr(self):
     """Special-case repr for miller-index objects"""
+    # Only used with cctbx, which always brings numpy
+    import numpy as np
+
     s = type(self).__name__ + "("
     if len(self):
         s += "["
@@ -101,20 +155,18 @@ def _miller_repr(self):
         indent = ",\n" + " " * len(s)
         # Work out how to align the data
         format_sample = self
-        if len(self) > _summaryThreshold:
-            format_sample = list(self[:_summaryEdgeItems]) + list(
-                self[-_summaryEdgeItems:]
-            )
+        summarise = len(self) > _summaryThreshold
+        if summarise:
+            # Slice the edges once, and reuse them for display
+            head = list(self[:_summaryEdgeItems])
+            tail = list(self[-_summaryEdgeItems:])
+            format_sample = head + tail
+        sample = np.asarray(format_sample, dtype=np.int64).reshape(-1, 3)
+        lowest, highest = sample.min(axis=0), sample.max(axis=0)
         # Do we have negative symbols
-        negs = [any(x[i] < 0 for x in format_sample) for i in range(3)]
-        # Maximum width
-        maxw = [
-            max(
-                int(1 + floor(log10(abs(x[i])) if x[i] != 0 else 0))
-                for x in format_sample
-            )
-            for i in range(3)
-        ]
+        negs = (lowest < 0).tolist()
+        # Maximum width, from the largest magnitude in each column
+        maxw = [len(str(x)) for x in np.maximum(highest, -lowest).tolist()]
         fmts = (
             "("
             + ", ".join(
@@ -128,11 +180,11 @@ def _miller_repr(self):
 
         # tup_fmt = ()
 
-        if len(self) > _summaryThreshold:
+        if summarise:
             "({: 3d}, {: 3d}, {: 3d})"
-            s += indent.join(fmts.format(*x) for x in self[:_summaryEdgeItems])
+            s += indent.join(fmts.format(*x) for x in head)
             s += indent + "..." + indent
-            s += indent.join(fmts.format(*x) for x in self[-_summaryEdgeItems:])
+            s += indent.join(fmts.format(*x) for x in tail)
         else:
             s += indent.join(fmts.format(*x) for x in self)
 
@@ -166,19 +218,28 @@ _max_column_height = 60
 
 def _reftable_repr(self):
     _max_display_width = 100
+    keys = list(self.keys())
     s = "<{}".format(type(self).__name__)
     if self:
         s += "\n"
         indent = "    "
-        maxcol = max(len(x) for x in self.keys())
+        maxcol = max(len(x) for x in keys)
+        pad = " " * maxcol
 
         rows = []
-        for column in sorted(self.keys()):
-            row = indent + column.ljust(maxcol) + " = "
+        for column in sorted(keys):
+            row = indent + column + pad[len(column) :] + " = "
             # Now do a single-line representation of the column....
             data = self[column]
             remaining_space = _max_display_width - len(row)
-            data_repr = " ".join(x.strip() for x in repr(data).splitlines())
+            # Only the start of the column will fit, so don't format the
+            # whole thing; every item takes at least one character
+            try:
+                if len(data) > remaining_space:
+                    data = data[:remaining_space]
+            except TypeError:
+                pass
+            data_repr = _ONE_LINE_SUB(" ", repr(data)).strip()
             if len(data_repr) > remaining_space:
                 data_repr = data_repr[: remaining_space - 3] + "..."
             row += data_repr
@@ -186,15 +247,16 @@ def _reftable_repr(self):
         s += "\n".join(rows)
     s += ">"
     if self:
-        s += "\n[{} rows x {} columns]".format(len(self), len(list(self.keys())))
+        s += "\n[{} rows x {} columns]".format(len(self), len(keys))
     return s
 
 
 # re_remove_dtype
 def _patch_flex(flex, dtype, shape=None, ndim=1):
     def _do_repr(x):
-        return re_remove_dtype.sub(
-            "", repr(x.as_numpy_array()).replace("array(", f"{type(x).__name__}(")
+        name = type(x).__name__ + "("
+        return _FLEX_REPR_SUB(
+            lambda m: name if m.group() == "array(" else "", repr(x.as_numpy_array())
         )
 
     flex.__repr__ = _do_repr
@@ -209,32 +271,45 @@ def _cctbx_crystal_symmetry_repr(self):
     return "symmetry({})".format(", ".join(parts))
 
 
+def _none():
+    return None
+
+
 def _cctbx_miller_set_repr(self):
     """Repr function for miller set and array objects"""
     parts = ["crystal_symmetry=" + _cctbx_crystal_symmetry_repr(self)]
     if self.indices():
-        parts.append("indices=" + reReprToOneLine.sub(" ", repr(self.indices())))
+        parts.append("indices=" + _ONE_LINE_SUB(" ", repr(self.indices())))
     if self.anomalous_flag() is not None:
         parts.append("anomalous_flag=" + str(self.anomalous_flag()))
-    if hasattr(self, "data") and self.data() is not None:
-        parts.append("data=" + reReprToOneLine.sub(" ", repr(self.data())))
-    if hasattr(self, "sigmas") and self.sigmas() is not None:
-        parts.append("sigmas=" + reReprToOneLine.sub(" ", repr(self.sigmas())))
-    if hasattr(self, "info") and self.info() is not None:
-        parts.append("sigmas=" + reReprToOneLine.sub(" ", repr(self.sigmas())))
+    # Plain miller sets have none of these
+    data = getattr(self, "data", _none)()
+    sigmas = getattr(self, "sigmas", _none)()
+    info = getattr(self, "info", _none)()
+    if data is not None:
+        parts.append("data=" + _ONE_LINE_SUB(" ", repr(data)))
+    if sigmas is not None:
+        parts.append("sigmas=" + _ONE_LINE_SUB(" ", repr(sigmas)))
+    if info is not None:
+        parts.append("info=" + repr(info))
 
     return type(self).__name__ + "(" + ", ".join(parts) + ")"
 
 
 def do_monkeypatching():
-    import cctbx.array_family.flex
-    import cctbx.crystal
-    import cctbx.miller
-    import cctbx.sgtbx
-    import cctbx.uctbx
-    import dials.array_family.flex
-    import dxtbx.model
-    import scitbx.array_family.flex
+    """Install the diagnostic reprs, skipping any packages that are missing"""
+    phil.scope_extract.__repr__ = _phil_repr
+    phil.scope_extract.__str__ = lambda x: x.__repr__(in_scope=True)
+
+    try:
+        import cctbx.array_family.flex
+        import cctbx.crystal
+        import cctbx.miller
+        import cctbx.sgtbx
+        import cctbx.uctbx
+        import scitbx.array_family.flex
+    except ImportError:
+        return
 
     _patch_flex(scitbx.array_family.flex.size_t, int)
     _patch_flex(scitbx.array_family.flex.double, float)
@@ -243,10 +318,6 @@ def do_monkeypatching():
 
     cctbx.array_family.flex.miller_index.__repr__ = _miller_repr
     scitbx.array_family.flex.vec3_double.__repr__ = _double_vec_repr
-    dials.array_family.flex.reflection_table.__repr__ = _reftable_repr
-
-    phil.scope_extract.__repr__ = _phil_repr
-    phil.scope_extract.__str__ = lambda x: x.__repr__(in_scope=True)
 
     cctbx.crystal.symmetry.__repr__ = _cctbx_crystal_symmetry_repr
     cctbx.miller.set.__repr__ = _cctbx_miller_set_repr
@@ -268,10 +339,23 @@ def do_monkeypatching():
         type(x).__name__, x.parameters()
     )
 
-    dxtbx.model.ExperimentList.__repr__ = (
-        lambda self: "[" + ", ".join(repr(x) for x in self) + "]"
-    )
+    try:
+        import dials.array_family.flex
+    except ImportError:
+        pass
+    else:
+        dials.array_family.flex.reflection_table.__repr__ = _reftable_repr
+
+    try:
+        import dxtbx.model
+    except ImportError:
+        pass
+    else:
+        dxtbx.model.ExperimentList.__repr__ = (
+            lambda self: "[" + ", ".join(repr(x) for x in self) + "]"
+        )
 
 
-# Always do this on import
-do_monkeypatching()
+# Do this on import, unless asked not to
+if os.environ.get("TBXTOOLS_MONKEYPATCH", "1") == "1":
+    do_monkeypatching()
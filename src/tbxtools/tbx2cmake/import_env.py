@@ -10,6 +10,7 @@ import logging
 import os
 import re
 import sys
+from functools import lru_cache
 from types import ModuleType
 
 # from .sconsemu import no_intercept_os
@@ -88,6 +89,8 @@ class libtbxEnv(object):
     def __init__(self, dist_path):
         self.build_options = libtbxBuildOptions()
         self._dist_path = dist_path
+        # Resolved dist paths, or MissingDistError for unresolvable modules
+        self._dist_cache = {}
 
     def under_build(self, path):
         return os.path.join("UNDERBUILD", path)  # UnderBuild(path)
@@ -96,6 +99,15 @@ class libtbxEnv(object):
         return os.path.join("BASEDIR", path)  # UnderBase(path)
 
     def dist_path(self, module):
+        try:
+            path = self._dist_cache[module]
+        except KeyError:
+            path = self._dist_cache[module] = self._find_dist_path(module)
+        if path is MissingDistError:
+            raise MissingDistError("Could not find dist path for module " + module)
+        return path
+
+    def _find_dist_path(self, module):
         logger.debug("Asked for dist path {} under {}".format(module, self._dist_path))
 
         with no_intercept_os():
@@ -114,11 +126,7 @@ class libtbxEnv(object):
         # never be asked for the path of a module that doesn't exist - if we
         # do, we should probably return something but this is a relatively
         # untested path
-        raise MissingDistError("Could not find dist path for module " + module)
-        assert False, "Couldnt find real dist path"
-        ret = "DISTPATH[{}]/".format(module)
-        logger.debug("   returning {} ".format(ret))
-        return ret
+        return MissingDistError
 
     def under_dist(self, module_name, path):
         return os.path.join("DISTPATH[{}]".format(module_name), path)
@@ -189,13 +197,18 @@ def _wtf(*args, **kwargs):
 
 
 def _unique_paths(paths):
-    return list(set(paths))
+    # Keep the first occurrence of each path, in order
+    return list(dict.fromkeys(paths))
+
+
+# Compiled select_matching patterns, by pattern string
+_compile_choice = lru_cache(maxsize=None)(re.compile)
 
 
 def _libtbx_select_matching(key, choices, default=None):
     # Too complex to try shortcutting the test; just replicate and catch results
     for key_pattern, value in choices:
-        m = re.search(key_pattern, key)
+        m = _compile_choice(key_pattern).search(key)
         if m is not None:
             return value
     return default
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import contextlib
-from collections import defaultdict
 
 
 @contextlib.contextmanager
@@ -44,7 +43,17 @@ class SystemEnvInterceptor(object):
 
     def __init__(self, intercept_source):
         self.details = intercept_source
-        self._orig = defaultdict(dict)
+        # Flattened (module, name) pairs, in the order they are swapped
+        self._swaps = [
+            (module, name)
+            for module, names in intercept_source.to_rewrite
+            for name in names
+        ]
+        # Resolve the replacements once, as suspend/resume re-enters often
+        self._fakes = [
+            getattr(intercept_source, "_fake_" + name) for _, name in self._swaps
+        ]
+        self._orig = []
 
     def __enter__(self):
         assert SystemEnvInterceptor.current is None
@@ -52,22 +61,19 @@ class SystemEnvInterceptor(object):
         # traceback.print_stack()
         SystemEnvInterceptor.current = self
 
-        for module, names in self.details.to_rewrite:
-            for name in names:
-                self._orig[module][name] = getattr(module, name)
-                setattr(module, name, getattr(self.details, "_fake_{}".format(name)))
-        self.details._orig = self._orig
+        self._orig = [getattr(module, name) for module, name in self._swaps]
+        for (module, name), fake in zip(self._swaps, self._fakes):
+            setattr(module, name, fake)
+        self.details._orig = dict(zip(self._swaps, self._orig))
 
     def __exit__(self, type, value, tb):
         # logger.debug("Exiting fake OS environment")
         # traceback.print_stack()
         self.details._orig = None
         # Reset these values in reverse order
-        for module, names in reversed(self.details.to_rewrite):
-            for name in names:
-                value = self._orig[module][name]
-                setattr(module, name, value)
-        self._orig.clear()
+        for (module, name), value in zip(reversed(self._swaps), reversed(self._orig)):
+            setattr(module, name, value)
+        self._orig = []
         SystemEnvInterceptor.current = None
 
     def suspend(self):
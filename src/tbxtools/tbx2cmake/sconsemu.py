@@ -1,8 +1,6 @@
 # coding: utf-8
 from __future__ import annotations
 
-import copy
-import inspect
 import logging
 import os
 import posixpath
@@ -12,13 +10,59 @@ from enum import Enum
 from pathlib import PosixPath, PurePosixPath, WindowsPath
 
 from .import_env import MissingDistError, do_import_patching
-from .intercept import SystemEnvInterceptor, no_intercept_os
+from .intercept import SystemEnvInterceptor
 from .utils import InjectableModule
 
 # Since we swizzle the OS definitions, decide "local" at import time
 Path = WindowsPath if (os.name == "nt") else PosixPath
 logger = logging.getLogger(__name__)
 
+# Libraries we don't track per-target. We know:
+# - Everything gets boost_thread, boost_system if threading is available
+# - Everything gets lm in SCons, unnecessary to track as universal
+UNIVERSAL_LIBS = frozenset({"boost_thread", "boost_system", "m"})
+
+# Link flags that we know about and can safely drop
+IGNORED_LINK_FLAGS = frozenset({"-fopenmp", "-shared", "-rdynamic"})
+
+# Include paths that every target is expected to have
+COMMON_INCLUDES = frozenset(
+    {
+        ".",
+        "DISTPATH",
+        "PYTHON/INCLUDE/PATH",
+        "UNDERBUILD/include",
+        "DISTPATH/boost",
+        "REPOSITORIES",
+        "BASEDIR/include",
+    }
+)
+
+# Canned TryRun answers, keyed on the name of the function asking
+_TRYRUN_BY_CALLER = {
+    # Yes, openMP works as far as libtbx configuration is concerned
+    "enable_openmp_if_possible": (1, "e=2.71828, pi=3.14159"),
+    # This writes out a file with information on size type equivalence.
+    # This is what the mac returns, but we handle this already anyway
+    "write_type_id_eq_h": (1, "0010"),
+}
+
+# TryCompile snippets that we just assume succeed
+_KNOWN_TRYCOMPILE = frozenset(
+    {
+        # This appears.... to test that a compiler actually works.
+        "#include <iostream>",
+        # Is Python available?
+        "#include <Python.h>",
+        # A second check of openGL inclusion
+        "#include <gltbx/include_opengl.h>",
+        # Looks to see if the fftw3 library is importable
+        "#include <fftw3.h>",
+        # I may have been known to test this on occasion
+        "#include <gtest/gtest.h>",
+    }
+)
+
 
 class ProgramReturn(object):
     """Thin shim to represent the return from a Program builder.
@@ -58,16 +102,11 @@ class SConsConfigurationContext(object):
         #   return (1, repr(data))
 
         # Get the name of the calling function
-        with no_intercept_os():
-            caller = inspect.stack()[1][3]
-
-        # Yes, openMP works as far as libtbx configuration is concerned
-        if caller == "enable_openmp_if_possible":
-            return (1, "e=2.71828, pi=3.14159")
-        # This writes out a file with information on size type equivalence.
-        if caller == "write_type_id_eq_h":
-            # This is what the mac returns, but we handle this already anyway
-            return (1, "0010")
+        caller = sys._getframe(1).f_code.co_name
+
+        result = _TRYRUN_BY_CALLER.get(caller)
+        if result is not None:
+            return result
         # Tests to see if we can include the openGL headers
         if "gltbx/include_opengl.h" in code:
             return (1, "6912")
@@ -90,20 +129,7 @@ class SConsConfigurationContext(object):
         #   """:
         #   return 1
 
-        # This appears.... to test that a compiler actually works.
-        if code == "#include <iostream>":
-            return 1
-        # Is Python available?
-        elif code == "#include <Python.h>":
-            return 1
-        # A second check of openGL inclusion
-        elif code.strip() == "#include <gltbx/include_opengl.h>":
-            return 1
-        # Looks to see if the fftw3 library is importable
-        elif code == "#include <fftw3.h>":
-            return 1
-        # I may have been known to test this on occasion
-        elif code == "#include <gtest/gtest.h>":
+        if code in _KNOWN_TRYCOMPILE or code.strip() in _KNOWN_TRYCOMPILE:
             return 1
 
         assert False, "Not recognised TryCompile"
@@ -113,38 +139,44 @@ class SConsConfigurationContext(object):
         pass
 
 
+def _stem(path):
+    """The final path component without its suffix, like PurePosixPath.stem"""
+    return posixpath.splitext(posixpath.basename(path))[0]
+
+
+def _shared_object_folder(runner):
+    """Work out the folder that unnamed shared objects are placed in"""
+    current_sconscript = runner._current_sconscript
+    parts = current_sconscript.parts
+    # cctbx_project is not a module root path
+    if parts[0] == "cctbx_project":
+        return PurePosixPath(*parts[1:-1])
+    return current_sconscript.parent
+
+
 class SharedObject(object):
     "Represents a shared object file that is compiled once and shared"
 
     def __init__(self, sources, environment, *, target=None):
-        # Work out where we are... this might be referred to elsewhere
-        current_sconscript = environment.runner._current_sconscript
-        # cctbx_project is not a module root path
-        if current_sconscript.parts[0] == "cctbx_project":
-            current_sconscript = current_sconscript.relative_to(
-                current_sconscript.parts[0]
-            )
-        this_folder_name = current_sconscript.parent
-
         if isinstance(sources, str) or hasattr(sources, "__fspath__"):
             sources = [sources]
-        self.sources = [PurePosixPath(x) for x in sources]
+        self.sources = [os.fspath(x) for x in sources]
         self.environment = environment
         if not target:
-            prefix = ""
-            for letters in zip(*[x.stem for x in self.sources]):
-                if len(set(letters)) == 1:
-                    prefix = prefix + letters[0]
+            # Characters shared by all source stems, position by position
+            prefix = "".join(
+                first
+                for first, *others in zip(*[_stem(x) for x in self.sources])
+                if all(x == first for x in others)
+            )
             self.prefix = prefix
-            self.name = f"#{this_folder_name}/{prefix}"
+            self.name = f"#{_shared_object_folder(environment.runner)}/{prefix}"
         elif target.endswith(".o"):
-            self.prefix = PurePosixPath(target).stem
+            self.prefix = _stem(target)
             self.name = target[:-2]
 
         # Pull this from target logic
-        self.origin_path = environment.runner._current_sconscript.relative_to(
-            PurePosixPath(environment.runner.dist_path)
-        ).parent
+        self.origin_path = environment.runner._current_origin_path
 
     def __repr__(self):
         return "<SharedObject {}>".format(",".join(str(x) for x in self.sources))
@@ -153,6 +185,21 @@ class SharedObject(object):
         return iter(self.sources)
 
 
+def _copy_env_kwargs(kwargs):
+    """Copy environment settings so that Append/Prepend don't leak across.
+
+    Only the containers themselves are mutated in place, so a full deepcopy
+    isn't needed - values are strings, or lists/dicts of them."""
+    copied = {}
+    for key, value in kwargs.items():
+        if type(value) is list:
+            value = list(value)
+        elif type(value) is dict:
+            value = dict(value)
+        copied[key] = value
+    return copied
+
+
 class SConsEnvironment(object):
     """Represents an object created by the scons Environment() call.
 
@@ -160,29 +207,31 @@ class SConsEnvironment(object):
     SCons-emulation environment.
     """
 
+    # Shared between all environments, so sequences are kept immutable. Append
+    # and Prepend start new, explicit lists rather than extending these.
     _DEFAULT_KWARGS = {
         "OBJSUFFIX": ".o",
-        "SHLINKFLAGS": [],
+        "SHLINKFLAGS": (),
         "BUILDERS": {},
-        "SHLINKCOM": ["SHLINKCOMDEFAULT"],
-        "LINKCOM": ["LINKCOMDEFAULT"],
-        "CCFLAGS": [],
-        "SHCCFLAGS": [],
-        "CXXFLAGS": [],
-        "SHCXXFLAGS": [],
+        "SHLINKCOM": ("SHLINKCOMDEFAULT",),
+        "LINKCOM": ("LINKCOMDEFAULT",),
+        "CCFLAGS": (),
+        "SHCCFLAGS": (),
+        "CXXFLAGS": (),
+        "SHCXXFLAGS": (),
         "PROGPREFIX": "",
         "PROGSUFFIX": "",
         "LIBPREFIX": "lib",
         "SHLIBPREFIX": "lib",
-        "LIBS": [],
-        "CPPPATH": [],
+        "LIBS": (),
+        "CPPPATH": (),
     }
 
     def __init__(self, emulator_environment, *args, **kwargs):
         self.runner = emulator_environment
         # self.parent = None
         self.args = args
-        self.kwargs = copy.deepcopy(kwargs)
+        self.kwargs = _copy_env_kwargs(kwargs)
         for key in self.kwargs:
             self._update(key)
 
@@ -192,19 +241,16 @@ class SConsEnvironment(object):
     def Append(self, **kwargs):
         for key, val in kwargs.items():
             if isinstance(val, str):
-                val = [val]
-            if key not in self.kwargs:
-                self.kwargs[key] = []
-            self.kwargs[key].extend(val)
+                val = (val,)
+            self.kwargs.setdefault(key, []).extend(val)
             self._update(key)
 
     def Prepend(self, **kwargs):
         for key, val in kwargs.items():
             if isinstance(val, str):
-                val = [val]
-            if key not in self.kwargs:
-                self.kwargs[key] = []
-            self.kwargs[key][:0] = val
+                val = (val,)
+            # A single slice assignment, so only one shift of the existing list
+            self.kwargs.setdefault(key, [])[:0] = val
             self._update(key)
 
     def Replace(self, **kwargs):
@@ -227,10 +273,11 @@ class SConsEnvironment(object):
         self._update(key)
 
     def __getitem__(self, key):
-        # Check the defaults first, so we only write to kwargs what isn't explicit
-        if key not in self.kwargs:
+        # Fall back to the defaults, so we only write to kwargs what is explicit
+        try:
+            return self.kwargs[key]
+        except KeyError:
             return self._DEFAULT_KWARGS[key]
-        return self.kwargs[key]
 
     def __contains__(self, key):
         return key in self.kwargs or key in self._DEFAULT_KWARGS
@@ -258,15 +305,20 @@ class SConsEnvironment(object):
             # mmtbx has added list targets
             assert len(target) == 1
             target = target[0]
+        # Normalise the name e.g. "./name" or "path/" - the output path
+        # is compared against exact strings later
         target = PurePosixPath(target)
         if target.parts[0].startswith("#lib"):
             target = PurePosixPath("#", "lib", target.parts[0][4:], *target.parts[1:])
-        target = Target(targettype, output_name=target, sources=source)
-        target.origin_path = self.runner._current_sconscript.relative_to(
-            PurePosixPath(self.runner.dist_path)
-        ).parent.as_posix()
-        target.env = self.Clone()
-        target.env.Append(**kwargs)
+        target = Target(targettype, output_name=os.fspath(target), sources=source)
+        target.origin_path = self.runner._current_origin_path.as_posix()
+        # Targets only read their environment here, so without any per-target
+        # settings there is no need to take a copy
+        if kwargs:
+            target.env = self.Clone()
+            target.env.Append(**kwargs)
+        else:
+            target.env = self
 
         # Massage lib list to flatten any odd sublists etc
         libs = set()
@@ -274,43 +326,29 @@ class SConsEnvironment(object):
             if isinstance(lib, str):
                 libs.add(lib)
             elif isinstance(lib, list):
-                libs |= set(lib)
+                libs.update(lib)
             else:
                 assert False
 
-        # Now let's filter/reduce the libs set. We know:
-        # - Everything gets boost_thread, boost_system if threading is available
-        # - Everything gets lm in SCons, unnecessary to track as universal
-        libs -= {"boost_thread", "boost_system", "m"}
-        target.extra_libs = libs
+        # Now let's filter/reduce the libs set
+        target.extra_libs = libs - UNIVERSAL_LIBS
 
         # Handle link flags
-        linkflags = list(target.env["SHLINKFLAGS"])
-        known_ignore_flags = {"-fopenmp", "-shared", "-rdynamic"}
-        for flag in known_ignore_flags:
-            while flag in linkflags:
-                linkflags.remove(flag)
+        linkflags = [
+            flag for flag in target.env["SHLINKFLAGS"] if flag not in IGNORED_LINK_FLAGS
+        ]
         assert not linkflags, "Unknown link flag: {}".format(linkflags)
         if linkflags:
-            logger.debug("Unhandled link flags: ", linkflags)
+            logger.debug("Unhandled link flags: %s", linkflags)
 
         # Handle include directories.
         # import pdb
         # pdb.set_trace()
-        if "CPPPATH" in target.env.kwargs:
+        if "CPPPATH" in target.env.kwargs and logger.isEnabledFor(logging.DEBUG):
             # Remove things we expect
-            COMMON_INCLUDES = {
-                ".",
-                "DISTPATH",
-                "PYTHON/INCLUDE/PATH",
-                "UNDERBUILD/include",
-                "DISTPATH/boost",
-                "REPOSITORIES",
-                "BASEDIR/include",
-            }
             extra_paths = set(target.env["CPPPATH"]) - COMMON_INCLUDES
             if extra_paths:
-                logger.debug("Path: {}".format(sorted(extra_paths)))
+                logger.debug("Path: %s", sorted(extra_paths))
 
         if targettype == Target.Type.SHARED:
             target.prefix = target.env["SHLIBPREFIX"]
@@ -319,7 +357,8 @@ class SConsEnvironment(object):
 
         target.module = self.runner._current_module
         target.module.targets.append(target)
-        logger.debug(str(target))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s", target)
 
         self.runner.targets.append(target)
         return target
@@ -340,7 +379,7 @@ class SConsEnvironment(object):
         # print("CUDA program: {}, {}".format(target, source))
 
     def SharedObject(self, source, *, target=None):
-        logger.debug("Shared object: {}".format(source))
+        logger.debug("Shared object: %s", source)
         # We want to create both a target (to build the shared object) and a reusable
         # shared object that can be used as a "source' in other targets
         obj = SharedObject(source, self, target=target)
@@ -440,8 +479,7 @@ class _fakeFile(object):
         self.data += data
 
     def read(self):
-        with no_intercept_os():
-            caller = inspect.stack()[1][3]
+        caller = sys._getframe(1).f_code.co_name
         if "csymlib.c" in self.filename or caller == "replace_printf":
             return ""
 
@@ -495,7 +533,7 @@ class _fake_system_env(object):
             logger.warning("Looking for package ncdist via filesystem lookup; ignoring")
             return False
 
-        logger.debug("IS DIR: {}".format(path))
+        logger.debug("IS DIR: %s", path)
         # Everything exists for sconsscripts!
         # allowed_exists = {,}
         return True
@@ -505,56 +543,73 @@ class _fake_system_env(object):
         if file.startswith("DISTPATH/ccp4io/libccp4/ccp4"):
             return False
 
-        logger.debug("IS FILE: {}".format(file))
-        logger.debug("".join(traceback.format_stack()))
-
-        with no_intercept_os():
-            # If given a special location, try to find it
-            if file.startswith("DISTPATH["):
-                module = file[9 : file.find("]")]
-                # Find this module in our distpath
-                for repo in [".", "cctbx_project"]:
-                    path = os.path.join(self.env.dist_path, repo, module)
-                    if os.path.isdir(path):
-                        file = path + file[len(module) + 10 :]
-            elif file.startswith("DISTPATH"):
-                file = os.path.join(self.env.dist_path, file[9:])
-            logger.debug("Out: {}".format(file))
-
-            if os.path.isfile(file):
-                logger.debug("  YES")
-                return True
-            else:
-                logger.debug("  NO")
-                return False
-            return os.path.isfile(file)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("IS FILE: %s", file)
+            logger.debug("".join(traceback.format_stack()))
+
+        # If given a special location, try to find it
+        if file.startswith("DISTPATH["):
+            module = file[9 : file.find("]")]
+            path = self.env._find_dist_module(module, self._orig[posixpath, "isdir"])
+            if path is not None:
+                file = path + file[len(module) + 10 :]
+        elif file.startswith("DISTPATH"):
+            file = os.path.join(self.env.dist_path, file[9:])
+        logger.debug("Out: %s", file)
+
+        # Use the real check directly, rather than suspending interception
+        result = self._orig[posixpath, "isfile"](file)
+        logger.debug("  %s", "YES" if result else "NO")
+        return result
 
     def _fake_exists(self, path):
-        logger.debug("EXISTS: {}".format(path))
-        logger.debug("".join(traceback.format_stack()))
-        return self._orig[os.path]["exists"](path)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("EXISTS: %s", path)
+            logger.debug("".join(traceback.format_stack()))
+        return self._orig[os.path, "exists"](path)
 
 
 class SconsEmulator(object):
     def __init__(self, dist):  # , modules):
         self._exports = {}
         self._current_sconscript = None
+        # Directory of the current SConscript, relative to the distribution
+        self._current_origin_path = None
         self._current_module = None
 
         self.dist_path = dist
+        self._dist_posix_path = PurePosixPath(dist)
+        # Repositories that DISTPATH[module] lookups search, and their results
+        self._dist_repos = [os.path.join(dist, repo) for repo in (".", "cctbx_project")]
+        self._dist_modules = {}
         # self.module_map = modules
 
         self.targets = []
 
         do_import_patching(dist)
 
+    def _find_dist_module(self, module, isdir):
+        """Find the path to a module in the distribution, or None"""
+        try:
+            return self._dist_modules[module]
+        except KeyError:
+            pass
+        found = None
+        # Later repositories take precedence
+        for repo in self._dist_repos:
+            path = os.path.join(repo, module)
+            if isdir(path):
+                found = path
+        self._dist_modules[module] = found
+        return found
+
     def parse_module(self, module):
         self._current_module = module
         scons = os.path.join(self.dist_path, module.path, "SConscript")
         if not os.path.isfile(scons):
-            logger.debug("No Sconscript for module {}".format(module.name))
+            logger.debug("No Sconscript for module %s", module.name)
             return
-        logger.info("Parsing {}".format(module.name))
+        logger.info("Parsing %s", module.name)
 
         self._fake_env = _fake_system_env(self)
         try:
@@ -567,9 +622,9 @@ class SconsEmulator(object):
 
     def sconscript_command(self, name, exports=None):
         newpath = self._current_sconscript.parent / PurePosixPath(name)
-        logger.debug("Loading sub-sconscript {}".format(newpath))
+        logger.debug("Loading sub-sconscript %s", newpath)
         self.parse_sconscript(newpath, custom_exports=exports)
-        logger.debug("Returning to sconscript {}".format(self._current_sconscript))
+        logger.debug("Returning to sconscript %s", self._current_sconscript)
 
     def parse_sconscript(self, filename, custom_exports=None):
         # Build the object used to run the script
@@ -577,14 +632,14 @@ class SconsEmulator(object):
 
         # Build the Scons injection environment
         def _env_export(*args):
-            logger.debug("Exporting {}".format(args))
+            logger.debug("Exporting %s", args)
             for name in args:
                 # Some places (nanobragg) use 'Export("envA envB")'
                 for fragment in name.split(" "):
                     self._exports[fragment] = module.getvar(fragment)
 
         def _env_import(*args):
-            logger.debug("Importing {}".format(args))
+            logger.debug("Importing %s", args)
             inj = {}
             for imp in args:
                 if custom_exports and imp in custom_exports:
@@ -621,7 +676,14 @@ class SconsEmulator(object):
         module.inject(inj)
         # Handle the stack of Sconscript processing
         prev_scons = self._current_sconscript
+        prev_origin = self._current_origin_path
         self._current_sconscript = Path(filename)
+        self._current_origin_path = self._current_sconscript.relative_to(
+            self._dist_posix_path
+        ).parent
         # Now execute the script
-        module.execute()
-        self._current_sconscript = prev_scons
+        try:
+            module.execute()
+        finally:
+            self._current_sconscript = prev_scons
+            self._current_origin_path = prev_origin
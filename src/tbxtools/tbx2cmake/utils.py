@@ -2,8 +2,9 @@
 from __future__ import annotations
 
 import contextlib
-import imp
+import functools
 import os
+import types
 
 
 class AttrDict(dict):
@@ -25,6 +26,13 @@ def return_as_list(f):
 
 def fully_split_path(path):
     "Splits a path until there is nothing left to split"
+    path = os.fspath(path)
+    if not path:
+        return []
+    # Relative paths split in one go; only anchored or slash-terminated
+    # paths need walking with os.path.split to keep their odd edge cases
+    if not path.startswith(os.sep) and not path.endswith(os.sep):
+        return [part for part in path.split(os.sep) if part]
     parts = []
     head = path
     tail = path
@@ -36,6 +44,13 @@ def fully_split_path(path):
     return parts
 
 
+@functools.lru_cache(maxsize=None)
+def _compile_script(path, mtime):
+    """Compile a script file. Keyed on mtime so that edits are picked up."""
+    with open(path) as f:
+        return compile(f.read(), path, "exec")
+
+
 class InjectableModule(object):
     """Load and run a python script with an injected globals dictionary.
     This is to emulate what it appears libtbx/scons does to run refresh scripts.
@@ -47,10 +62,9 @@ class InjectableModule(object):
 
         :param pathlib.Path module_path: The python script to load
         """
-        module = imp.new_module(module_path.stem)
+        module = types.ModuleType(module_path.stem)
         module.__file__ = str(module_path.parent)
-        with module_path.open() as f:
-            self.bytecode = compile(f.read(), str(module_path), "exec")
+        self.bytecode = _compile_script(str(module_path), module_path.stat().st_mtime)
         self.module = module
 
     def inject(self, globals):
@@ -22,11 +22,13 @@ Options:
 
 from __future__ import annotations
 
+import functools
 import itertools
 import logging
 import os
 import pkgutil
 import posixpath
+import re
 import sys
 from pathlib import Path, PurePosixPath
 
@@ -37,6 +39,11 @@ from .read_scons import TBXDistribution, read_distribution
 from .sconsemu import Target
 from .utils import fully_split_path
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 logger = logging.getLogger()
 
 # Renames from Scons-library targets to CMake names
@@ -75,6 +82,15 @@ REQUIRED_OPTIONAL: set[str] = set()
 
 _warned_types: set[str] = set()
 
+# Lines added to a target for each optional dependency. Starts with a blank line.
+OPTIONAL_DEPENDENCY_TEMPLATE = """
+# Optional dependency on {option}
+if(TARGET {renamed})
+  target_link_libraries({name} PUBLIC {renamed})
+endif()"""
+
+_TRAILING_WHITESPACE = re.compile(r"[ \t]+$", re.MULTILINE)
+
 
 class CMakeLists(object):
     "Represents a single CMakeLists file. Keeps track of subdirectories."
@@ -87,27 +103,35 @@ class CMakeLists(object):
         self.is_module_root = False
         self.targets = []
         self._module = None
+        # Nodes previously returned by get_path
+        self._path_cache = {}
+        # Subdirectories sorted by name; reset whenever one is added
+        self._sorted_subdirectories = None
 
     def get_path(self, path):
         "Returns a CMakeLists object for a specific subpath"
+        try:
+            return self._path_cache[path]
+        except KeyError:
+            pass
         assert not os.path.isabs(path)
         parts = fully_split_path(path)
         assert ".." not in parts, "No relative referencing implemented"
-        if parts[0] in {"", "."}:
-            return self
-        else:
+        node = self
+        while parts and parts[0] not in {"", "."}:
             # Skip over the cctbx_project subdir for a module-based root
             if parts[0] == "cctbx_project":
                 parts = [os.path.join(*parts[:2])] + parts[2:]
-            if parts[0] not in self.subdirectories:
-                subdir = CMakeLists(parts[0], parent=self)
-                self.subdirectories[parts[0]] = subdir
-            else:
-                subdir = self.subdirectories[parts[0]]
-            if len(parts) > 1:
-                return subdir.get_path(os.path.join(*parts[1:]))
+            if parts[0] not in node.subdirectories:
+                subdir = CMakeLists(parts[0], parent=node)
+                node.subdirectories[parts[0]] = subdir
+                node._sorted_subdirectories = None
             else:
-                return subdir
+                subdir = node.subdirectories[parts[0]]
+            node = subdir
+            parts = parts[1:]
+        self._path_cache[path] = node
+        return node
 
     def draw_tree(self, indent="", last=True, root=True):
         "Quick and easy function to dump a tree representation" ""
@@ -126,19 +150,31 @@ class CMakeLists(object):
         print(
             line.ljust(25 - len(self.path))
         )  # + " ({} targets)".format(len(self.targets)))
-        for i, child in enumerate(
-            sorted(self.subdirectories.values(), key=lambda x: x.path)
-        ):
-            child.draw_tree(indent, i == len(self.subdirectories) - 1, root=False)
+        children = self.sorted_subdirectories
+        for i, child in enumerate(children):
+            child.draw_tree(indent, i == len(children) - 1, root=False)
 
     def all(self):
-        yield self
-        for child in self.subdirectories.values():
-            for result in child.all():
-                yield result
+        "Iterate over this and every descendant CMakeLists, depth-first"
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            # Reversed, so that children are visited in insertion order
+            stack.extend(reversed(node.subdirectories.values()))
 
     @property
+    def sorted_subdirectories(self):
+        "The child CMakeLists objects, ordered by path"
+        if self._sorted_subdirectories is None:
+            self._sorted_subdirectories = [
+                self.subdirectories[name] for name in sorted(self.subdirectories)
+            ]
+        return self._sorted_subdirectories
+
+    @functools.cached_property
     def full_path(self):
+        # Safe to cache, as nodes are never moved once created
         if self.parent:
             return os.path.join(self.parent.full_path, self.path)
         else:
@@ -196,8 +232,8 @@ class CMakeListBlock(object):
 class CMLSubDirBlock(CMakeListBlock):
     def __str__(self):
         lines = []
-        for subdir in sorted(self.cml.subdirectories):
-            lines.append("add_subdirectory({})".format(subdir))
+        for subdir in self.cml.sorted_subdirectories:
+            lines.append("add_subdirectory({})".format(subdir.path))
         return "\n".join(lines)
 
 
@@ -279,8 +315,9 @@ def _append_list_to(line, list, join=" ", indent=4, append=("", ""), firstindent
     if firstindent is None:
         firstindent = " " * indent
 
-    if len(line + join.join(list)) + 2 <= 78:
-        return line + join.join(list) + append[0]
+    inline = join.join(list)
+    if len(line) + len(inline) + 2 <= 78:
+        return line + inline + append[0]
     else:
         joiner = join.strip() + "\n" + " " * indent
         return line + "\n" + firstindent + joiner.join(list) + append[1]
@@ -331,14 +368,17 @@ class CMLLibraryOutput(CMakeListBlock):
 
     def _get_extra_libs(self):
         extra_libs = (
-            self.target.extra_libs - OPTIONAL_DEPENDS - self.target.optional_extra_libs
-        ) | self.target.required_optional
+            self.target.extra_libs.difference(
+                OPTIONAL_DEPENDS, self.target.optional_extra_libs
+            )
+            | self.target.required_optional
+        )
 
         # extra_libs = self.target.extra_libs -  - self.target.optional_extra_libs
         if self.is_python_module:
-            extra_libs = extra_libs - {"boost_python"}
+            extra_libs.discard("boost_python")
         else:
-            extra_libs |= {"boost"}
+            extra_libs.add("boost")
 
         if self.target.shared_sources:
             extra_libs = extra_libs | {
@@ -348,13 +388,15 @@ class CMLLibraryOutput(CMakeListBlock):
         return extra_libs
 
     def __str__(self):
+        # Dependency names to CMake target names, see _target_rename
+        rename = DEPENDENCY_RENAMES.get
         add_command = self._get_target_add_string()
         add_lib = add_command.format(self.target.name, self.typename)
 
         # Work out if we can put all the sources on one line
         lines = []
 
-        sources_list = [str(x) for x in self.target.sources]
+        sources_list = list(map(str, self.target.sources))
         # Now do object libraries
         sources_list.extend(
             f"$<TARGET_OBJECTS:{obj.target.name}>" for obj in self.target.shared_sources
@@ -426,7 +468,7 @@ class CMLLibraryOutput(CMakeListBlock):
         if extra_libs:
             lines.append(
                 "target_link_libraries( {} PUBLIC {} )".format(
-                    self.target.name, " ".join(_target_rename(x) for x in extra_libs)
+                    self.target.name, " ".join(rename(x, x) for x in extra_libs)
                 )
             )
 
@@ -450,16 +492,12 @@ class CMLLibraryOutput(CMakeListBlock):
         # Handle any optional dependencies
         if optional_libs:
             for option in optional_libs:
-                lines.extend(
-                    [
-                        "",
-                        "# Optional dependency on {}".format(option),
-                        "if(TARGET {})".format(_target_rename(option)),
-                        "  target_link_libraries({} PUBLIC {})".format(
-                            self.target.name, _target_rename(option)
-                        ),
-                        "endif()",
-                    ]
+                lines.append(
+                    OPTIONAL_DEPENDENCY_TEMPLATE.format(
+                        name=self.target.name,
+                        option=option,
+                        renamed=rename(option, option),
+                    )
                 )
 
         # Required optional handling: Libraries that are otherwise optional, but this
@@ -487,7 +525,7 @@ class CMLLibraryOutput(CMakeListBlock):
                 )
 
             conditions = " AND ".join(
-                ("TARGET {}".format(_target_rename(x)) for x in combined_requirements)
+                ("TARGET {}".format(rename(x, x)) for x in combined_requirements)
             )
             cond_lines = [comment_message, "if({})".format(conditions)]
             cond_lines.extend("  " + x for x in lines)
@@ -564,14 +602,47 @@ def _expand_target_lib_list(target, liblist, values):
         setattr(target, listname, getattr(target, listname) | set(values))
 
 
+@functools.lru_cache(maxsize=None)
+def _load_build_info(filename=None, stamp=None):
+    """Parse a build information file, or the packaged defaults if None.
+
+    The stamp is only used to key the cache, so that modified files are
+    re-read. The result is shared between calls and must not be modified.
+    """
+    if filename:
+        with open(filename, "rb") as f:
+            return yaml.load(f, Loader=SafeLoader)
+    return yaml.load(
+        pkgutil.get_data("tbxtools.tbx2cmake", "build_info.yaml"), Loader=SafeLoader
+    )
+
+
+def _is_listed_file(path, dir_files):
+    """Equivalent to os.path.isfile, but via a cache of directory listings.
+
+    :param dir_files: dict of directory to the files within, filled as needed
+    """
+    directory, name = os.path.split(path)
+    try:
+        files = dir_files[directory]
+    except KeyError:
+        try:
+            with os.scandir(directory or ".") as entries:
+                files = frozenset(x.name for x in entries if x.is_file())
+        except (FileNotFoundError, NotADirectoryError):
+            files = frozenset()
+        dir_files[directory] = files
+    return name in files
+
+
 def _read_autogen_information(filename, tbx: TBXDistribution):
     "Read a build information override file and apply to a distribution"
 
     if filename:
-        with open(filename) as f:
-            data = yaml.safe_load(f)
+        stat = os.stat(filename)
+        data = _load_build_info(filename, (stat.st_mtime_ns, stat.st_size))
     else:
-        data = yaml.safe_load(pkgutil.get_data("tbxtools.tbx2cmake", "build_info.yaml"))
+        data = _load_build_info()
 
     # Load the list of module-refresh-generated files
     for modname, value in data.get("libtbx_refresh", {}).items():
@@ -579,84 +650,95 @@ def _read_autogen_information(filename, tbx: TBXDistribution):
         module.generated_sources.extend(value)
 
     # Add the generated sources information
-    tbx.other_generated = data.get("other_generated", [])
+    tbx.other_generated = list(data.get("other_generated", []))
+    # This is rebuilt on every access, so take it once now it is complete
+    all_generated = tbx.all_generated
+
+    # Find *all* shared objects, in all targets
+    all_shared_objects = {
+        obj.name: obj
+        for obj in itertools.chain(
+            *[x.shared_sources for x in tbx.targets if x.shared_sources]
+        )
+    }
 
-    # Find all targets that use repository-lookup sources
+    # Resolve every target's sources. Repository-lookup sources (starting with
+    # '#') are rewritten relative to the target, and sources that aren't on disk
+    # are relative to "source or build" so are matched against shared objects or
+    # marked explicitly as generated.
+    module_root = Path(tbx.module_path)
+    repositories = [PurePosixPath(x) for x in ("", "cctbx_project")]
+    all_unknown = set()
+    # Files in each source directory, so that we don't stat every source
+    dir_files = {}
     for target in tbx.targets:
-        lookup_sources = [x for x in target.sources if Path(x).parts[0].startswith("#")]
+        sources = []
+        rewritten = []
         unknown = set()
-        for source in lookup_sources:
-            # If the source is generated, then mark it so and it'll be
-            # read from the build dir
-            if source[1:] in tbx.all_generated:
-                target.sources.remove(source)
-                target.generated_sources.add(source[1:])
-            else:
+        # Where this target's generated sources live; only worked out if needed
+        generated_root = None
+        # Rewritten lookups are checked after, and end up after, the others
+        for source in itertools.chain(target.sources, rewritten):
+            if source.startswith("#"):
+                # If the source is generated, then mark it so and it'll be
+                # read from the build dir
+                if source[1:] in all_generated:
+                    target.generated_sources.add(source[1:])
+                    continue
                 # This might be a general-lookup source. Find the actual directory.
-                source_fs = str(Path(PurePosixPath(source[1:])))
-                repositories = ["", "cctbx_project"]
-                for repo in (Path(x) for x in repositories):
-                    full_path = Path(tbx.module_path) / repo / source_fs
-                    if full_path.is_file():
+                source_path = PurePosixPath(source[1:])
+                for repo in repositories:
+                    repo_source = repo / source_path
+                    if (module_root / repo_source).is_file():
                         # print("Found {} in {}".format(source, repo))
                         # Change the sources list to use a relative
                         # reference to the target path
-                        target.sources.remove(source)
                         relpath = posixpath.relpath(
-                            (repo / source_fs).as_posix(), target.origin_path
+                            repo_source.as_posix(), target.origin_path
                         )
-                        target.sources.append(relpath)
+                        rewritten.append(relpath)
                         # print("  rewriting to {}".format(relpath))
                         break
-                # Did we find?
-                if source in target.sources:
+                else:
+                    # Didn't find, so leave as-is
+                    sources.append(source)
                     unknown.add(source)
-
-        if unknown:
-            print(
-                "Unknown {} from {}: {}".format(
-                    target.name, target.origin_path, unknown
-                )
-            )
-
-    # Find *all* shared objects, in all targets
-    all_shared_objects = {
-        obj.name: obj
-        for obj in itertools.chain(
-            *[x.shared_sources for x in tbx.targets if x.shared_sources]
-        )
-    }
-    # Now, some of the sources are relative to "source or build" and so we need to
-    # mark them as explicitly generated.
-    for target in tbx.targets:
-        for source in list(target.sources):
-            if not os.path.isfile(
-                os.path.join(tbx.module_path, target.origin_path, source)
+            elif _is_listed_file(
+                os.path.join(tbx.module_path, target.origin_path, source), dir_files
             ):
+                sources.append(source)
+            else:
                 # print("Could not find {}:{}".format(target.name, source))
-                # Look in the generated sources list
-                relpath = posixpath.relpath(
-                    target.origin_path, Path(target.module.path).as_posix()
-                )
-                genpath = posixpath.normpath(
-                    posixpath.join(target.module.name, relpath, source)
-                )
                 # Check is this one of our shared objects?
                 if source in all_shared_objects:
                     logger.debug("Found source %s in shared object list", source)
-                    target.sources.remove(source)
                     target.shared_sources.append(all_shared_objects[source])
                     continue
 
+                # Look in the generated sources list
+                if generated_root is None:
+                    relpath = posixpath.relpath(
+                        target.origin_path, Path(target.module.path).as_posix()
+                    )
+                    generated_root = posixpath.join(target.module.name, relpath)
+                genpath = posixpath.normpath(posixpath.join(generated_root, source))
                 assert (
-                    genpath in tbx.all_generated
+                    genpath in all_generated
                 ), "Could not find missing source {}:{}".format(target.name, source)
                 # print("   Found generated at {}".format(genpath))
-                target.sources.remove(source)
                 target.generated_sources.add(genpath)
+        target.sources[:] = sources
+
+        if unknown:
+            print(
+                "Unknown {} from {}: {}".format(
+                    target.name, target.origin_path, unknown
+                )
+            )
+            all_unknown |= unknown
 
     # Double-check that we have no unknown lookup sources
-    assert not unknown, "Unknown scons-repository sources: {}".format(unknown)
+    assert not all_unknown, "Unknown scons-repository sources: {}".format(all_unknown)
 
     # Warn about any targets with no normal sources
     for target in tbx.targets:
@@ -747,6 +829,22 @@ def _target_rename(name):
     return DEPENDENCY_RENAMES.get(name, name)
 
 
+def _write_if_changed(filename, data):
+    """Write a file, unless it already has exactly this content.
+
+    Leaving unchanged files alone keeps their modification times, so that
+    CMake doesn't see them as changed and reconfigure.
+    """
+    try:
+        with open(filename) as f:
+            if f.read() == data:
+                return
+    except FileNotFoundError:
+        pass
+    with open(filename, "w") as f:
+        f.write(data)
+
+
 def main():
     options = docopt(__doc__)
     logging.basicConfig(level=logging.INFO if not options["-v"] else logging.DEBUG)
@@ -790,21 +888,19 @@ def main():
     # root.draw_tree()
 
     # Make sure the output path exists
-    if not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
 
     for cml in root.all():
         path = os.path.join(output_dir, cml.full_path)
-        if not os.path.isdir(path):
-            os.makedirs(path)
+        os.makedirs(path, exist_ok=True)
         filename = "CMakeLists.txt"
         if cml is root:
             filename = "autogen_CMakeLists.txt"
-        with open(os.path.join(path, filename), "w") as f:
-            lines = cml.generate_cmakelist().splitlines()
-            # Strip any trailing whitespace
-            data = "\n".join(x.rstrip() for x in lines)
-            f.write(data)
+        # Strip any trailing whitespace, including the final newline
+        data = _TRAILING_WHITESPACE.sub("", cml.generate_cmakelist())
+        if data.endswith("\n"):
+            data = data[:-1]
+        _write_if_changed(os.path.join(path, filename), data)
 
 
 if __name__ == "__main__":
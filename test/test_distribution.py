@@ -1,12 +1,15 @@
 # coding: utf-8
 from __future__ import annotations
 
+import ast
 import logging
 import os
 
 import pytest
 
+import tbxtools.model
 from tbxtools import DependencyError, Distribution
+from tbxtools.model import _parse_libtbx_config
 
 logging.basicConfig(level=logging.INFO)
 test_dist = os.path.join(os.path.dirname(__file__), "fake_distribution")
@@ -46,3 +49,43 @@ def testOptionalDependency():
     dist.request_modules(["i_have_optional_dependencies"])
     assert "repo_module" in dist
     assert "i_have_optional_dependencies" in dist
+
+
+def testConfigNotSharedBetweenDistributions():
+    dist = Distribution(test_dist, ignore_missing=["repo_module"])
+    dist.request_modules(["root_module"])
+    assert not dist["root_module"].config["modules_required_for_build"]
+    # The cached config for a second load must not see the first's changes
+    dist = Distribution(test_dist)
+    dist.request_modules(["root_module"])
+    assert dist["root_module"].config["modules_required_for_build"] == {"repo_module"}
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"modules_required_for_use": ["a", "b"]}',
+        # Trailing commas
+        '{\n  "modules_required_for_build": ["a", "b",],\n  "optional_modules": [],\n}',
+        # Python-only syntax
+        "{'modules_required_for_use': ['a'], 'python_required': ('numpy',)}",
+        '{"flag": True, "other": None}',
+        # Comma-bracket sequences inside strings must not be changed
+        '{"name": "a,]", "other": "b, }", "list": ["c,]",],}',
+        '{"escaped": "d\\\\",}',
+    ],
+)
+def testParseLibtbxConfig(text):
+    assert _parse_libtbx_config(text) == ast.literal_eval(text)
+
+
+def testParseLibtbxConfigJsonPath(monkeypatch):
+    # json-compatible configs shouldn't need the python literal fallback
+    text = '{"name": "a,]", "list": ["c, }", "d",],}'
+    expected = ast.literal_eval(text)
+
+    def _no_fallback(text):
+        raise AssertionError("Fell back to literal_eval")
+
+    monkeypatch.setattr(tbxtools.model.ast, "literal_eval", _no_fallback)
+    assert _parse_libtbx_config(text) == expected
@@ -0,0 +1,189 @@
+# coding: utf-8
+from __future__ import annotations
+
+import os
+from pathlib import PurePath, PurePosixPath
+from types import SimpleNamespace
+
+import pytest
+
+from tbxtools.tbx2cmake.read_scons import (
+    DependencyGraph,
+    LibTBXModule,
+    TBXDistribution,
+    _build_dependency_graph,
+)
+from tbxtools.tbx2cmake.sconsemu import SConsEnvironment, Target
+from tbxtools.tbx2cmake.utils import fully_split_path
+
+
+def _environment():
+    "Create an environment attached to a minimal stand-in emulator"
+    runner = SimpleNamespace(
+        _current_origin_path=PurePosixPath("module"),
+        _current_module=SimpleNamespace(targets=[]),
+        targets=[],
+    )
+    return SConsEnvironment(runner)
+
+
+@pytest.mark.parametrize(
+    "name,output_path,output_name",
+    [
+        ("./foo", "", "foo"),
+        ("lib/x/", "lib", "x"),
+        ("bin//prog", "bin", "prog"),
+        ("#lib/thing", "#/lib", "thing"),
+        ("#libsub/thing", "#/lib/sub", "thing"),
+        (["#lib/listed"], "#/lib", "listed"),
+    ],
+)
+def testTargetNameNormalised(name, output_path, output_name):
+    target = _environment().SharedLibrary(target=name, source=["a.cpp"])
+    assert target.output_path == output_path
+    assert target.name == output_name
+
+
+def testGraphSelfLoop():
+    G = DependencyGraph(["a", "b"])
+    G.add_edge("a", "b")
+    G.add_edge("b", "b")
+    assert G.find_cycle() == [("b", "b")]
+
+
+def testGraphAcyclic():
+    G = DependencyGraph(["a", "b", "c", "d"])
+    # A diamond revisits d, but isn't a cycle
+    G.add_edge("a", "b")
+    G.add_edge("a", "c")
+    G.add_edge("b", "d")
+    G.add_edge("c", "d")
+    explored = set()
+    assert G.find_cycle(explored) is None
+    assert explored == {"a", "b", "c", "d"}
+
+
+def testGraphCycleFromLaterStart():
+    G = DependencyGraph(["a", "b", "p", "q", "r"])
+    G.add_edge("a", "b")
+    # Only reachable from the later start nodes, not including p itself
+    G.add_edge("p", "q")
+    G.add_edge("q", "r")
+    G.add_edge("r", "q")
+    explored = set()
+    assert G.find_cycle(explored) == [("q", "r"), ("r", "q")]
+    # The acyclic nodes explored first are kept for the next search
+    assert {"a", "b"} <= explored
+    assert not {"p", "q", "r"} & explored
+    G.remove_edge("r", "q")
+    assert G.find_cycle(explored) is None
+    assert explored == set(G)
+
+
+def testGraphLexicographicalSort():
+    G = DependencyGraph(["c", "a", "z", "b"])
+    assert G.lexicographical_topological_sort() == ["a", "b", "c", "z"]
+    # Every node must come before those it has edges to, but ties go by name
+    G.add_edge("z", "a")
+    G.add_edge("c", "b")
+    assert G.lexicographical_topological_sort() == ["c", "b", "z", "a"]
+    G.add_edge("a", "z")
+    with pytest.raises(RuntimeError):
+        G.lexicographical_topological_sort()
+
+
+def _make_module(root, name, config=None):
+    "Create a module folder with an optional libtbx_config"
+    (root / name).mkdir()
+    if config is not None:
+        (root / name / "libtbx_config").write_text(repr(config))
+    return LibTBXModule(name, name, str(root))
+
+
+def testDependencyCyclesBroken(tmp_path):
+    modules = [
+        _make_module(tmp_path, "libtbx"),
+        _make_module(tmp_path, "a", {"modules_required_for_build": ["b"]}),
+        _make_module(tmp_path, "b", {"optional_modules": ["a"]}),
+        _make_module(tmp_path, "c", {"modules_required_for_use": ["d"]}),
+        _make_module(tmp_path, "d", {"modules_required_for_build": ["c"]}),
+        _make_module(tmp_path, "e", {"modules_required_for_use": ["e"]}),
+    ]
+    G = _build_dependency_graph(modules)
+    assert G.find_cycle() is None
+    # In each cycle, the edge with the weakest requirement is removed
+    assert set(G.edges) == {
+        ("a", "b"),
+        ("d", "c"),
+        ("scitbx", "omptbx"),
+    } | {(x.name, "libtbx") for x in modules if x.name != "libtbx"}
+
+
+def _add_target(module, name):
+    target = Target(Target.Type.SHARED, name, [])
+    target.module = module
+    module.targets.append(target)
+    return target
+
+
+def testTargetCollectionTracksChanges():
+    tbx = TBXDistribution()
+    module = SimpleNamespace(name="mod", targets=[])
+    tbx._modules["mod"] = module
+    first = _add_target(module, "first")
+    assert list(tbx.targets) == [first]
+    assert "first" in tbx.targets
+
+    # Replacing the target list, without changing the length
+    replacement = Target(Target.Type.SHARED, "second", [])
+    replacement.module = module
+    module.targets = [replacement]
+    assert list(tbx.targets) == [replacement]
+    assert "first" not in tbx.targets
+    assert tbx.targets["second"] is replacement
+
+    # Renaming a target requires invalidating the collection
+    replacement.name = "renamed"
+    assert "second" not in tbx.targets
+    tbx.targets._invalidate()
+    assert list(tbx.targets) == [replacement]
+    assert "renamed" in tbx.targets
+    assert tbx.targets["renamed"] is replacement
+    with pytest.raises(KeyError):
+        tbx.targets["second"]
+
+
+def _reference_split_path(path):
+    "The original fully_split_path, walking os.path.split for every part"
+    parts = []
+    head = path
+    tail = path
+    while head and tail:
+        head, tail = os.path.split(head)
+        parts.insert(0, tail)
+    if head:
+        parts.insert(0, head)
+    return parts
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "",
+        "a",
+        "a/b/c",
+        "a//b",
+        "./a/b",
+        ".",
+        "/",
+        "/a/b",
+        "//a/b",
+        "a/b/",
+        "/a/b/",
+        PurePath("a/b/c"),
+        PurePath("/a/b"),
+        PurePath(""),
+    ],
+)
+def testFullySplitPath(path):
+    assert fully_split_path(path) == _reference_split_path(path)